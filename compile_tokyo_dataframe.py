@@ -1,8 +1,23 @@
 import pandas as pd
+import numpy as np
 import argparse
 import re
 import os
 import sys
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from csv_output import write_csv
+
+# --- Optional pyarrow: multithreaded CSV parse, Arrow-backed strings ---
+try:
+    import pyarrow as pa
+    CSV_ENGINE = 'pyarrow'
+    TEXT_DTYPE = 'string[pyarrow]'
+except ImportError:
+    pa = None
+    CSV_ENGINE = 'c'
+    TEXT_DTYPE = 'string'
 
 # --- Sudachi for name validation ---
 try:
@@ -18,6 +33,14 @@ except Exception as e:
     _sudachi_tokenizer = None
 
 
+# Leading circle symbols that may prefix office names
+_HEADER_CIRCLE_SYMBOLS = "◎〇O○o0〓●"
+# OCR-malformed headers (from the TOC) start with an opening bracket
+_HEADER_BAD_STARTS = '({[（「【'
+# Characters office names end with
+_HEADER_ENDINGS = frozenset("課係所房合院室場局屋寮館康ム班部衛宿校署區")
+
+
 def is_header_candidate(text, headers_set):
     """
     Returns True if text is likely a Department/Office name.
@@ -32,12 +55,11 @@ def is_header_candidate(text, headers_set):
         return False
 
     # Reject OCR-malformed headers (leading parentheses/brackets from TOC)
-    if text[0] in '({[（「【':
+    if text[0] in _HEADER_BAD_STARTS:
         return False
 
     # Strip leading circle symbols — offices may start with them
-    circle_symbols = "◎〇O○o0〓●"
-    cleaned = text.lstrip(circle_symbols).strip()
+    cleaned = text.lstrip(_HEADER_CIRCLE_SYMBOLS).strip()
     if not cleaned:
         return False
 
@@ -46,16 +68,30 @@ def is_header_candidate(text, headers_set):
         return True
 
     # 2. Pattern-based detection: office names end with these characters
-    office_endings = set("課係所房合院室場局屋寮館康ム班部衛宿校署區")
-    if len(cleaned) < 15 and cleaned[-1] in office_endings:
+    if len(cleaned) < 15 and cleaned[-1] in _HEADER_ENDINGS:
         # Reject position titles like 課長, 部長 (office ending + 長)
-        if not text.endswith('長'):
+        if text[-1] != '長':
             return True
 
     return False
 
 
-def is_position_only_row(row, known_positions):
+def header_candidate_mask(texts, headers_set):
+    """
+    Vectorized is_header_candidate over a Series of stripped strings.
+    Returns a boolean ndarray.
+    """
+    cleaned = texts.str.lstrip(_HEADER_CIRCLE_SYMBOLS).str.strip()
+    in_crosswalk = texts.isin(headers_set) | cleaned.isin(headers_set)
+    by_pattern = ((cleaned.str.len() < 15)
+                  & cleaned.str[-1:].isin(_HEADER_ENDINGS)
+                  & ~texts.str.endswith('長'))
+    well_formed = ~texts.str[:1].isin(set(_HEADER_BAD_STARTS)) & (cleaned != '')
+    return (well_formed & (in_crosswalk | by_pattern)).to_numpy(dtype=bool)
+
+
+@functools.lru_cache(maxsize=200_000)
+def is_position_only_row(pos, name, raw, known_positions):
     """
     Detect rows where the line is ONLY a position title (no person name).
     These are standalone position headers in the directory layout.
@@ -64,14 +100,10 @@ def is_position_only_row(row, known_positions):
       - position is a known title AND name is empty/NaN
       - OR: raw_text exactly matches a known position
       - OR: name field itself is a known position (misclassified by stage 1)
-    """
-    pos = str(row.get('position', '')).strip()
-    name = str(row.get('name', '')).strip()
-    raw = str(row.get('raw_text', '')).strip()
-
-    if pos == 'nan': pos = ''
-    if name == 'nan': name = ''
 
+    Expects already-stripped strings (main() cleans text columns on load).
+    Results are cached, so known_positions must be a frozenset.
+    """
     # Case 1: Stage 1 matched a position and name is empty
     if pos and pos != 'Unknown' and not name:
         return True, pos
@@ -87,55 +119,95 @@ def is_position_only_row(row, known_positions):
     return False, None
 
 
-def is_likely_noise(row):
+# --- Noise filter patterns ---
+# Ellipsis/dot runs (page references like "……一五三")
+_ELLIPSIS_RE = re.compile(r'[…・．\.]{2,}')
+# Library stamps
+_LIBRARY_RE = re.compile(r'図書館|蔵書|東京都立')
+# Phone/address numbers (numeral followed later by 番)
+_BAN_NUMBER_RE = re.compile(r'[〇一二三四五六七八九十\d].*番')
+# Fused alternations so raw is scanned once: the ban-number branch only
+# applies to rows without a position match
+_NOISE_MARK_RE = re.compile(
+    _ELLIPSIS_RE.pattern + '|' + _LIBRARY_RE.pattern)
+_NOISE_MARK_OR_BAN_RE = re.compile(
+    _NOISE_MARK_RE.pattern + '|' + _BAN_NUMBER_RE.pattern)
+
+
+# Classical grammar particles (regulatory text) and kanji numerals
+_CLASSICAL_PARTICLES = frozenset('ハノヲニスル')
+_KANJI_NUMERAL_CHARS = '一二三四五六七八九十百千万〇零'
+_KANJI_NUMERALS = frozenset(_KANJI_NUMERAL_CHARS)
+
+
+def _char_stats(raw):
+    """
+    Counts Latin letters, classical particles and numerals (digits or kanji
+    numerals) in one pass over raw. The three classes never overlap.
+    Returns (n_latin, n_particles, n_numeric).
+    """
+    n_latin = n_particles = n_numeric = 0
+    for c in raw:
+        if c in _CLASSICAL_PARTICLES:
+            n_particles += 1
+        elif c in _KANJI_NUMERALS or c.isdigit():
+            n_numeric += 1
+        elif c.isascii() and c.isalpha():
+            n_latin += 1
+    return n_latin, n_particles, n_numeric
+
+
+def is_likely_noise(raw, name, pos):
     """
     Filter out OCR noise from cross-column reads, regulatory text,
     library stamps, page references, and other non-personnel content.
+    Takes the fields unstripped, as stage 1 wrote them (missing values
+    blanked): the length and ratio thresholds count surrounding spaces.
     """
-    raw = str(row.get('raw_text', ''))
-    name = str(row.get('name', ''))
+    # Only "is there a position match" matters, which keeps the cache small
+    return _is_likely_noise(raw, name, pos == 'Unknown')
 
-    # 1. Latin/symbol dominated lines (like "RT/0・317/88/GA")
-    if raw and len(raw) > 3:
-        n_latin = sum(1 for c in raw if c.isascii() and c.isalpha())
-        if n_latin / len(raw) > 0.4:
-            return True
 
-    # 2. Very long raw_text with no position match — likely cross-column read
-    if len(raw) > 25 and str(row.get('position', '')) == 'Unknown':
-        unique_ratio = len(set(raw)) / len(raw) if raw else 0
-        if unique_ratio > 0.7:
-            return True
+@functools.lru_cache(maxsize=200_000)
+def _is_likely_noise(raw, name, pos_unknown):
+    # OCR output repeats the same lines often, so results are memoized.
+    # Every check can only flag a row, so they run cheapest first.
+    n_raw = len(raw)
 
-    # 3. Single-char name from long raw_text (fragment from bad split)
-    if len(name) == 1 and len(raw) > 15:
+    # 1. Single-char name from long raw_text (fragment from bad split)
+    if len(name) == 1 and n_raw > 15:
         return True
 
-    # 4. Ellipsis/dot patterns (page references like "……一五三")
-    if re.search(r'[…・．\.]{2,}', raw):
+    # 2. Ellipsis/dot patterns (page references like "……一五三"), library
+    #    stamps, and — without a valid position — phone/address patterns
+    #    (the ban branch backtracks through every numeral, so it is only
+    #    included when a plain substring test finds 番 at all)
+    use_ban = pos_unknown and '番' in raw
+    noise_re = _NOISE_MARK_OR_BAN_RE if use_ban else _NOISE_MARK_RE
+    if noise_re.search(raw):
         return True
 
-    # 5. Classical grammar particle density (regulatory text like "ヲ調査蒐録ス")
-    if len(raw) > 8:
-        classical_particles = set('ハノヲニスル')
-        n_particles = sum(1 for c in raw if c in classical_particles)
-        if n_particles / len(raw) > 0.15:
-            return True
+    # The ratio checks below all need at least 3 characters
+    if n_raw <= 2:
+        return False
+    n_latin, n_particles, n_numeric = _char_stats(raw)
 
-    # 6. Library stamps
-    if re.search(r'図書館|蔵書|東京都立', raw):
+    # 3. Latin/symbol dominated lines (like "RT/0・317/88/GA")
+    if n_raw > 3 and n_latin / n_raw > 0.4:
         return True
 
-    # 7. Numeric-dominated (>50% digits or kanji numerals)
-    if raw:
-        kanji_nums = set('一二三四五六七八九十百千万〇零')
-        n_numeric = sum(1 for c in raw if c.isdigit() or c in kanji_nums)
-        if len(raw) > 2 and n_numeric / len(raw) > 0.5:
-            return True
+    # 4. Classical grammar particle density (regulatory text like "ヲ調査蒐録ス")
+    if n_raw > 8 and n_particles / n_raw > 0.15:
+        return True
 
-    # 8. Phone/address patterns without a valid position
-    if re.search(r'番', raw) and str(row.get('position', '')) == 'Unknown':
-        if re.search(r'[〇一二三四五六七八九十\d].*番', raw):
+    # 5. Numeric-dominated (>50% digits or kanji numerals)
+    if n_numeric / n_raw > 0.5:
+        return True
+
+    # 6. Very long raw_text with no position match — likely cross-column read.
+    #    Checked last: it is the only check that allocates (a set of chars)
+    if n_raw > 25 and pos_unknown:
+        if len(set(raw)) / n_raw > 0.7:
             return True
 
     return False
@@ -143,13 +215,16 @@ def is_likely_noise(row):
 
 # Katakana given names that Sudachi classifies as common nouns rather than person names.
 # These are unambiguously names in a personnel directory context.
-_KATAKANA_GIVEN_NAMES = {
+_KATAKANA_GIVEN_NAMES = frozenset({
     'ヨシ', 'キヨ', 'ハナ', 'ハル', 'フミ', 'トミ', 'チヨ', 'シズ',
     'ウメ', 'マツ', 'キク', 'ツル', 'ミツ', 'タケ', 'サダ', 'トク',
     'マサ', 'カネ', 'ヤス', 'ナカ', 'タカ', 'シゲ', 'アキ', 'テル',
     'ミヨ', 'スミ', 'ノブ', 'ヒデ', 'トシ', 'クニ', 'イネ', 'トメ',
     'スエ', 'タミ', 'ヒサ', 'ムメ', 'リン', 'セツ', 'ミネ', 'フク',
-}
+})
+
+# Leading part-of-speech fields of a Sudachi person-name token
+_PERSON_NAME_POS = ('名詞', '固有名詞', '人名')
 
 
 def _sudachi_has_person_name(name):
@@ -170,7 +245,7 @@ def _sudachi_has_person_name(name):
     has_surname = False
     for token in tokens:
         pos = token.part_of_speech()
-        if pos[0] == '名詞' and pos[1] == '固有名詞' and pos[2] == '人名':
+        if pos[:3] == _PERSON_NAME_POS:
             surface = token.surface()
             name_chars += len(surface)
             if len(surface) >= 2:
@@ -187,6 +262,23 @@ def _sudachi_has_person_name(name):
     return True
 
 
+# --- Heuristic name-validation patterns (used only without Sudachi) ---
+# Date characters, era/temporal words, and regulation/rank characters in one
+# alternation (any hit means the text is not a name)
+_NAME_REJECT_RE = re.compile(
+    r'[年月日號條項則級俸給勳位階官]|昭和|大正|明治|平成|現在|以上|以下')
+# Office-name final characters (a name ending in one is an office, not a person)
+_OFFICE_SUFFIX_CHARS = frozenset('課係局部署區室寮所院庁')
+_NAME_PARTICLE_RE = re.compile(r'[のをはがでノヲハガデ]')
+# Particles only count against names over 3 chars; for those, one search
+# covers both the reject words and the particles
+_NAME_REJECT_OR_PARTICLE_RE = re.compile(
+    _NAME_REJECT_RE.pattern + '|' + _NAME_PARTICLE_RE.pattern)
+# CJK unified ideographs (incl. extension A) and katakana
+_CJK_CHAR_RE = re.compile(r'[\u4e00-\u9fff\u30a0-\u30ff\u3400-\u4dbf]')
+
+
+@functools.lru_cache(maxsize=200_000)
 def is_plausible_name(name):
     """
     Returns True if name looks like a Japanese personal name.
@@ -202,9 +294,7 @@ def is_plausible_name(name):
         return False
 
     # Must be >=80% CJK or katakana
-    n_cjk = sum(1 for c in name if '\u4e00' <= c <= '\u9fff'
-                or '\u30a0' <= c <= '\u30ff'
-                or '\u3400' <= c <= '\u4dbf')
+    n_cjk = len(_CJK_CHAR_RE.findall(name))
     if n_cjk / len(name) < 0.8:
         return False
 
@@ -213,23 +303,49 @@ def is_plausible_name(name):
         return _sudachi_has_person_name(name)
 
     # --- Heuristic fallback (only if Sudachi unavailable) ---
-    if re.search(r'[年月日]', name):
-        return False
-    if re.search(r'昭和|大正|明治|平成|現在|以上|以下', name):
+    reject_re = _NAME_REJECT_OR_PARTICLE_RE if len(name) > 3 else _NAME_REJECT_RE
+    if reject_re.search(name):
         return False
-    if re.search(r'[號條項則級俸給勳位階官]', name):
+    if name[-1] in _OFFICE_SUFFIX_CHARS and len(name) > 2:
         return False
-    if re.search(r'[課係局部署區室寮所院庁]$', name) and len(name) > 2:
-        return False
-    if len(name) > 3 and re.search(r'[のをはがでノヲハガデ]', name):
-        return False
-    kanji_nums = set('一二三四五六七八九十百千万〇零')
-    if all(c in kanji_nums for c in name):
+    # All kanji numerals: stripping that alphabet (in C) leaves nothing
+    if not name.strip(_KANJI_NUMERAL_CHARS):
         return False
 
     return True
 
 
+def validate_names(names, pool=None):
+    """
+    Runs is_plausible_name over distinct names and returns {name: bool}.
+    With a process pool the names are sharded across its workers (each has
+    its own Sudachi tokenizer); otherwise they are checked in-process.
+    """
+    if pool is None:
+        return {n: is_plausible_name(n) for n in names}
+    return dict(zip(names, pool.map(is_plausible_name, names, chunksize=256)))
+
+
+# --- Gender heuristic patterns ---
+# Surnames ending in a "female" kanji (legacy R blocklist); whole-name match
+_SURNAME_LEGACY = frozenset({
+    '金子', '増子', '尼子', '砂子', '白子', '呼子', '舞子', '神子'})
+_FEMALE_LEGACY_RE = re.compile(r'[子枝江代紀美恵貴]$|婦$|^[小]?[佐]?[美]')
+# Extended blocklist and kanji endings for the modern heuristic
+_SURNAME_MODERN = _SURNAME_LEGACY | frozenset({
+    '平子', '星子', '鳴子', '銚子', '逗子', '厨子', '対子', '硝子', '茄子',
+    '種子', '扇子', '格子', '障子', '帽子'})
+_FEMALE_MODERN_RE = re.compile(
+    r'[子枝江代紀美恵貴乃花世奈穂織里香]$|婦$|^[小]?[佐]?[美]')
+# Katakana female given names (common in pre-war/wartime era)
+_KATAKANA_FEMALE = frozenset({
+    'ヨシ', 'キヨ', 'ハナ', 'ハル', 'フミ', 'トミ', 'チヨ', 'シズ',
+    'ウメ', 'マツ', 'キク', 'ツル', 'ミツ', 'タケ', 'サダ', 'トク',
+    'マサ', 'カネ', 'ヤス', 'ナカ', 'タカ', 'シゲ', 'アキ', 'テル',
+    'ミヨ', 'スミ', 'ノブ', 'ヒデ', 'トシ', 'クニ',
+})
+
+
 def classify_gender_legacy(name):
     """
     Gender classification matching the legacy R heuristic.
@@ -241,13 +357,9 @@ def classify_gender_legacy(name):
     if not name:
         return ""
 
-    surname_blocklist = re.compile(
-        r'^(金子|増子|尼子|砂子|白子|呼子|舞子|神子)$')
-    female_kanji_pat = re.compile(r'[子枝江代紀美恵貴]$|婦$|^[小]?[佐]?[美]')
-
-    if surname_blocklist.match(name):
+    if name in _SURNAME_LEGACY:
         return "male"
-    if female_kanji_pat.search(name):
+    if _FEMALE_LEGACY_RE.search(name):
         return "female"
     return "male"
 
@@ -262,38 +374,56 @@ def classify_gender_modern(name):
     if not name:
         return ""
 
-    surname_blocklist = re.compile(
-        r'^(金子|増子|尼子|砂子|白子|呼子|舞子|神子|平子|星子|鳴子|'
-        r'銚子|逗子|厨子|対子|硝子|茄子|種子|扇子|格子|障子|帽子)$')
-
-    if surname_blocklist.match(name):
+    if name in _SURNAME_MODERN:
         return "male"
 
     # Extended kanji endings
-    female_kanji_pat = re.compile(
-        r'[子枝江代紀美恵貴乃花世奈穂織里香]$|婦$|^[小]?[佐]?[美]')
-    if female_kanji_pat.search(name):
+    if _FEMALE_MODERN_RE.search(name):
         return "female"
 
-    # Katakana female given names (common in pre-war/wartime era)
-    katakana_female = {
-        'ヨシ', 'キヨ', 'ハナ', 'ハル', 'フミ', 'トミ', 'チヨ', 'シズ',
-        'ウメ', 'マツ', 'キク', 'ツル', 'ミツ', 'タケ', 'サダ', 'トク',
-        'マサ', 'カネ', 'ヤス', 'ナカ', 'タカ', 'シゲ', 'アキ', 'テル',
-        'ミヨ', 'スミ', 'ノブ', 'ヒデ', 'トシ', 'クニ',
-    }
-    # For 2-char names, check if the whole name matches katakana female
-    if len(name) == 2 and name in katakana_female:
+    # Katakana female given names: for 2-char names, the whole name must
+    # match; for longer names, the name must end with one
+    if len(name) == 2 and name in _KATAKANA_FEMALE:
         return "female"
-    # For longer names, check if the name ends with a katakana female given name
     if len(name) > 2:
         suffix = name[-2:]
-        if suffix in katakana_female:
+        if suffix in _KATAKANA_FEMALE:
             return "female"
 
     return "male"
 
 
+def classify_gender_columns(names, is_name):
+    """
+    Vectorized classify_gender_legacy / classify_gender_modern over a list
+    of names. Rows where is_name is False get "". Returns (legacy, modern)
+    as object ndarrays.
+    """
+    # Classify each distinct name once; codes map the results back to rows
+    codes, uniques = pd.factorize(pd.Series(names, dtype=object).str.strip())
+    s = pd.Series(uniques, dtype=object)
+    is_name = np.asarray(is_name, dtype=bool) & (s != '').to_numpy()[codes]
+
+    # Every legacy match is also a modern match (the modern endings extend
+    # the legacy ones), so the legacy regex only runs on modern hits
+    kanji_modern = s.str.contains(_FEMALE_MODERN_RE)
+    kanji_legacy = kanji_modern.copy()
+    kanji_legacy[kanji_modern] = s[kanji_modern].str.contains(_FEMALE_LEGACY_RE)
+
+    female_legacy = kanji_legacy & ~s.isin(_SURNAME_LEGACY)
+    # Titles in _KATAKANA_FEMALE are all 2 chars, so a last-two-chars check
+    # covers both the whole-name and the suffix case
+    female_modern = ((kanji_modern | s.str[-2:].isin(_KATAKANA_FEMALE))
+                     & ~s.isin(_SURNAME_MODERN))
+
+    def label(female):
+        female = female.to_numpy(dtype=bool)[codes]
+        return np.where(is_name, np.where(female, "female", "male"),
+                        "").astype(object)
+
+    return label(female_legacy), label(female_modern)
+
+
 # ============================================================
 # Office hierarchy inference
 # ============================================================
@@ -318,14 +448,17 @@ KYUJI_MAP = str.maketrans({
 _OFFICE_LEADING_SYMBOLS = '〓◇◆△▲○●□■☆★※＊・〔〕〃◎〇Oo0'
 
 # Level-3 compound endings — sorted longest-first so maximal match wins
-_L3_COMPOUNDS = sorted([
+_L3_COMPOUNDS = tuple(sorted([
     '地方事務所', '出納員室',
     '営業所', '出張所', '試験所', '研究所', '事務所', '事業所', '保健所',
     '清掃所', '取締所', '指導所', '訓練所', '検定所', '相談所', '処分場',
     '作業所', '診療所', '保養所', '授産場', '種畜場', '消毒所',
     '試験場', '区役所',
     '工場', '分場', '支所',
-], key=len, reverse=True)
+], key=len, reverse=True))
+
+# Leading parenthetical (e.g. "（本庁）") stripped from office names
+_LEADING_PAREN_RE = re.compile(r'^[（(〔][^）)〕]*[）)〕]?')
 
 # Level-1 exact matches (checked before any suffix rule)
 _L1_EXACT = frozenset({'知事室', '出納長室', '中央卸売市場'})
@@ -345,7 +478,7 @@ def normalize_office(text):
     # Strip leading circle/marker symbols (matches R's first str_remove)
     text = text.lstrip(_OFFICE_LEADING_SYMBOLS).strip()
     # Strip leading parenthetical expressions, e.g. （局名）or (注記) (matches R's second str_remove)
-    text = re.sub(r'^[（(〔][^）)〕]*[）)〕]?', '', text).strip()
+    text = _LEADING_PAREN_RE.sub('', text).strip()
     return text.translate(KYUJI_MAP)
 
 
@@ -368,24 +501,22 @@ def classify_office_level(normed):
     if normed in _L1_EXACT:
         return 1
     # 2. Level-3 compound endings
-    for comp in _L3_COMPOUNDS:
-        if normed.endswith(comp):
-            return 3
+    if normed.endswith(_L3_COMPOUNDS):
+        return 3
     # 3. Level-4
     if normed.endswith('係'):
         return 4
     # 4. Level-1: 局, or 院 not in blocked list
     if normed.endswith('局'):
         return 1
-    if normed.endswith('院') and not any(normed.endswith(b) for b in _L1_BLOCKED_IN):
+    if normed.endswith('院') and not normed.endswith(_L1_BLOCKED_IN):
         return 1
     # 5. Level-2
     if normed.endswith('部'):
         return 2
     # 6. Level-3 simple
-    for suf in _L3_SIMPLE:
-        if normed.endswith(suf):
-            return 3
+    if normed.endswith(_L3_SIMPLE):
+        return 3
     return None
 
 
@@ -403,49 +534,48 @@ def infer_office_hierarchy(df):
 
     Uses the cumulative-group technique: a new group starts whenever a
     header of the relevant level (or higher) transitions in, then all rows
-    in that group are filled with the header value via groupby-first.
+    in that group are filled with the header value. Years are laid out
+    contiguously first, so each year boundary is just one more group start
+    and the whole frame is handled in a single vectorized pass.
     """
     df = df.copy()
-    df['office_norm'] = df['office'].apply(normalize_office)
-    df['off_level'] = df['office_norm'].apply(classify_office_level)
-
-    parts = []
-    for _year, ydf in df.groupby('year', sort=False):
-        ydf = ydf.copy()
-
-        # Detect rows where the office section transitions
-        changed = ydf['office'] != ydf['office'].shift()
-        lvl = ydf['off_level']
-
-        is_l1 = (lvl == 1) & changed
-        is_l2 = (lvl == 2) & changed
-        is_l3 = (lvl == 3) & changed
-        is_l4 = (lvl == 4) & changed
-
-        # Cumulative group IDs — increment at each relevant transition
-        kyoku_grp  = is_l1.cumsum()
-        bu_grp     = (is_l1 | is_l2).cumsum()
-        ka_grp     = (is_l1 | is_l2 | is_l3).cumsum()
-        kakari_grp = (is_l1 | is_l2 | is_l3 | is_l4).cumsum()
-
-        # Place the office name only at the header row that opens each group
-        norm = ydf['office_norm']
-        ydf['_k']  = norm.where(is_l1)
-        ydf['_b']  = norm.where(is_l2)
-        ydf['_ka'] = norm.where(is_l3)
-        ydf['_kk'] = norm.where(is_l4)
-
-        # Forward-fill: all rows in a group receive the header value
-        # groupby().first() skips NaN, so only the non-NaN header value propagates
-        ydf['kyoku']  = ydf.groupby(kyoku_grp )['_k' ].transform('first')
-        ydf['bu']     = ydf.groupby(bu_grp    )['_b' ].transform('first')
-        ydf['ka']     = ydf.groupby(ka_grp    )['_ka'].transform('first')
-        ydf['kakari'] = ydf.groupby(kakari_grp)['_kk'].transform('first')
-
-        ydf.drop(columns=['_k', '_b', '_ka', '_kk'], inplace=True)
-        parts.append(ydf)
-
-    result = pd.concat(parts) if parts else df
+    # Only a few hundred distinct offices span the whole run, so normalize
+    # and classify each once and map the results onto the rows
+    norm_of = {o: normalize_office(o) for o in df['office'].unique()}
+    df['office_norm'] = df['office'].map(norm_of)
+    level_of = {o: classify_office_level(o) for o in set(norm_of.values())}
+    df['off_level'] = df['office_norm'].map(level_of)
+
+    # Order years by first appearance (stable within a year) and drop rows
+    # with no year — the same rows and order a groupby('year') would yield
+    year_codes = pd.factorize(df['year'])[0]
+    has_year = year_codes >= 0
+    order = np.argsort(year_codes[has_year], kind='stable')
+    result = df[has_year].iloc[order]
+
+    # Detect rows where the year or the office section transitions
+    year_start = (result['year'] != result['year'].shift()).to_numpy()
+    changed = (result['office'] != result['office'].shift()).to_numpy() | year_start
+    lvl = result['off_level'].to_numpy()
+
+    is_l1 = (lvl == 1) & changed
+    is_l2 = (lvl == 2) & changed
+    is_l3 = (lvl == 3) & changed
+    is_l4 = (lvl == 4) & changed
+
+    norm = result['office_norm'].to_numpy(dtype=object)
+    row_idx = np.arange(len(result))
+
+    def fill_from_header(is_header, opens_group):
+        # Each row takes the header value at the start of its group (NaN when
+        # the group was opened by a year boundary rather than a header)
+        group_start = np.maximum.accumulate(np.where(opens_group, row_idx, 0))
+        return np.where(is_header, norm, np.nan)[group_start]
+
+    result['kyoku']  = fill_from_header(is_l1, year_start | is_l1)
+    result['bu']     = fill_from_header(is_l2, year_start | is_l1 | is_l2)
+    result['ka']     = fill_from_header(is_l3, year_start | is_l1 | is_l2 | is_l3)
+    result['kakari'] = fill_from_header(is_l4, year_start | is_l1 | is_l2 | is_l3 | is_l4)
 
     # Detect index pages: pages with 3+ distinct 局-level offices on one page
     # (matches R's section 4 — flag but do not drop; caller can filter)
@@ -506,6 +636,11 @@ def _print_hierarchy_diagnostics(df):
         print("\nAll Japanese office names matched a hierarchy level.")
 
 
+# Salary (月 + kanji numerals) and rank (正/従 + numeral) in v1 name strings
+_SALARY_RE = re.compile(r'月([一二三四五六七八九十百〇]+)')
+_RANK_RE = re.compile(r'([正従][一二三四五六七八九十][位]?)')
+
+
 def parse_metadata_fallback(text):
     """
     Fallback metadata extraction for v1 format CSVs.
@@ -515,12 +650,12 @@ def parse_metadata_fallback(text):
     if not isinstance(text, str):
         return "", "", ""
 
-    sal_match = re.search(r'月([一二三四五六七八九十百〇]+)', text)
+    sal_match = _SALARY_RE.search(text)
     if sal_match:
         salary = sal_match.group(1)
         text = text[:sal_match.start()] + text[sal_match.end():]
 
-    rank_match = re.search(r'([正従][一二三四五六七八九十][位]?)', text)
+    rank_match = _RANK_RE.search(text)
     if rank_match:
         rank = rank_match.group(1)
         text = text[:rank_match.start()] + text[rank_match.end():]
@@ -528,6 +663,249 @@ def parse_metadata_fallback(text):
     return text.strip(" ,　"), salary, rank
 
 
+# Drafted (military conscription) keywords, matched anywhere in raw text
+DRAFT_KEYWORDS = ("應召", "召中", "應徴", "徴中", "入營", "營中")
+_DRAFT_RE = re.compile('|'.join(map(re.escape, DRAFT_KEYWORDS)))
+
+# Single-person positions: only the first name gets the title
+SINGLE_PERSON_POSITIONS = frozenset({'課長', '主事', '技師'})
+
+# Stage 1 columns the compiler reads; free-text ones are loaded as strings
+TEXT_COLUMNS = ('name', 'position', 'raw_text', 'salary', 'rank', 'grade',
+                'image')
+INPUT_COLUMNS = frozenset(TEXT_COLUMNS + ('year', 'folder', 'x', 'y'))
+
+
+def new_compile_state():
+    """
+    Returns the state carried between blocks of stage 1 rows: the current
+    office, the open position group (title, whether a person row opened it,
+    how many rows have inherited from it so far), and the running counters.
+    """
+    return {
+        'office': "Unknown Office",
+        'position': "Unknown",
+        'position_by_person': False,
+        'n_inheritors': 0,
+        'n_page_filtered': 0,
+        'n_noise_filtered': 0,
+        'n_position_headers': 0,
+        'n_position_propagated': 0,
+    }
+
+
+def compile_block(df, state, known_positions, headers_set, page_range,
+                  default_year, name_pool=None):
+    """
+    Compiles one block of stage 1 rows into person records: filters pages
+    and noise, propagates office and position, and extracts the per-person
+    fields. state (see new_compile_state) is read and updated in place so
+    consecutive blocks behave like one continuous input. name_pool, if
+    given, is a process pool for name validation (see validate_names).
+    Returns a DataFrame of person rows, or None if the block has none.
+    """
+    has_v2_columns = all(c in df.columns for c in ['grade', 'salary', 'rank'])
+
+    # Blank out missing text fields and strip them once, column-wise, so
+    # the loop and the row predicates can use the values as-is. Interning
+    # makes each repeated office/title string a single shared object.
+    # The noise filter (Step 0b) is the exception: it measures lengths and
+    # character ratios on the fields as stage 1 wrote them, so it keeps
+    # the unstripped values.
+    text_cols = [c for c in TEXT_COLUMNS if c in df.columns]
+    df[text_cols] = df[text_cols].fillna('')
+    noise_cols = ('raw_text', 'name', 'position')
+    unstripped = {c: df[c].to_numpy() for c in noise_cols if c in df.columns}
+    df[text_cols] = df[text_cols].apply(
+        lambda col: col.str.strip().map(sys.intern))
+
+    # Pull each column out as a plain array once; the loop indexes these
+    # directly instead of materializing a row object per iteration.
+    n_rows = len(df)
+
+    def column(col, default):
+        if col in df.columns:
+            return df[col].to_numpy()
+        return [default] * n_rows
+
+    names = column('name', '')
+    positions = column('position', '')
+    raw_texts = column('raw_text', '')
+    salaries = column('salary', '')
+    ranks = column('rank', '')
+    grades = column('grade', '')
+    years = column('year', default_year)
+    folders = column('folder', '')
+    images = column('image', '')
+    xs = column('x', 0)
+    ys = column('y', 0)
+
+    # --- Step 0a: Page range filter (human-specified) ---
+    if page_range is not None:
+        start_pg, end_pg = page_range
+        page_nums = pd.to_numeric(pd.Series(folders), errors='coerce').fillna(0)
+        in_range = ((page_nums >= start_pg) & (page_nums <= end_pg)).to_numpy()
+    else:
+        in_range = np.ones(n_rows, dtype=bool)
+
+    # --- Step 0b: Filter OCR noise ---
+    is_noise = np.zeros(n_rows, dtype=bool)
+    noise_raw, noise_name, noise_pos = (
+        unstripped[c] if c in unstripped else column(c, '') for c in noise_cols)
+    for i in np.flatnonzero(in_range):
+        is_noise[i] = is_likely_noise(noise_raw[i], noise_name[i], noise_pos[i])
+
+    # --- Step 1: Office header detection (pattern-based, vectorized) ---
+    # Headers depend only on the row itself, so the current office is a
+    # forward fill over the header rows.
+    name_s = pd.Series(names, dtype=object)
+    pos_s = pd.Series(positions, dtype=object)
+    text_s = pd.Series(raw_texts, dtype=object)
+    # Also check raw_text for office names that stage 1 didn't classify
+    text_needed = ((name_s == '') & (pos_s == '')).to_numpy()
+
+    # The header test is a pure function of the string, so run it once over
+    # the distinct candidates from all three fields and map the result back
+    candidates = pd.Series(pd.unique(np.concatenate(
+        [name_s.to_numpy(), pos_s.to_numpy(), text_s.to_numpy()[text_needed]])))
+    header_strings = set(candidates[header_candidate_mask(candidates, headers_set)])
+
+    name_is_header = name_s.isin(header_strings).to_numpy()
+    pos_is_header = pos_s.isin(header_strings).to_numpy()
+    text_is_header = text_s.isin(header_strings).to_numpy() & text_needed
+
+    office_headers = np.select(
+        [name_is_header, pos_is_header, text_is_header],
+        [name_s.to_numpy(), pos_s.to_numpy(), text_s.to_numpy()],
+        default=None)
+    office_headers[~in_range | is_noise] = None
+
+    current_offices = (pd.Series(office_headers, dtype=object)
+                       .ffill().fillna(state['office']).to_numpy())
+    if n_rows:
+        state['office'] = current_offices[-1]
+    is_body = in_range & ~is_noise & pd.isna(office_headers)
+
+    state['n_page_filtered'] += int((~in_range).sum())
+    state['n_noise_filtered'] += int(is_noise.sum())
+
+    # --- Step 2: Standalone position header detection ---
+    header_pos = np.full(n_rows, None, dtype=object)
+    for i in np.flatnonzero(is_body):
+        is_pos_header, detected_pos = is_position_only_row(
+            positions[i], names[i], raw_texts[i], known_positions)
+        if is_pos_header:
+            header_pos[i] = detected_pos
+    is_pos_header = pd.notna(header_pos)
+
+    # --- Step 3: Position propagation (cumulative-group technique) ---
+    # A person row with an explicit position sets the current position, as
+    # does a position header; other person rows inherit it. Each setter
+    # starts a group, and a single-person title is only handed to the
+    # first inheritor of a header-started group.
+    pos_arr = np.asarray(positions, dtype=object)
+    is_person = (is_body & ~is_pos_header
+                 & ((np.asarray(names, dtype=object) != '') | (pos_arr != '')))
+    is_explicit = is_person & (pos_arr != '') & (pos_arr != 'Unknown')
+
+    events = np.flatnonzero(is_pos_header | is_person)
+    ev_sets = (is_pos_header | is_explicit)[events]
+    ev_value = np.where(is_pos_header, header_pos, pos_arr)[events]
+    group = np.cumsum(ev_sets)  # 0 = before the first setter
+
+    # Group 0 continues the group carried over from the previous block
+    group_value = np.concatenate(
+        [[state['position']], ev_value[ev_sets]]).astype(object)[group]
+    group_by_person = np.concatenate(
+        [[state['position_by_person']], is_explicit[events][ev_sets]])[group]
+    inherit_rank = (pd.Series(~ev_sets).groupby(group).cumsum().to_numpy() - 1
+                    + np.where(group == 0, state['n_inheritors'], 0))
+
+    single = pd.Series(group_value).isin(SINGLE_PERSON_POSITIONS).to_numpy()
+    inherits = (group_value != "Unknown") & ~(single & (group_by_person | (inherit_rank > 0)))
+
+    effective_pos = np.full(n_rows, "Unknown", dtype=object)
+    effective_pos[events] = np.where(ev_sets, ev_value,
+                                     np.where(inherits, group_value, "Unknown"))
+
+    state['n_position_headers'] += int(is_pos_header.sum())
+    state['n_position_propagated'] += int((~ev_sets & inherits).sum())
+    if len(events):
+        last_group = group == group[-1]
+        n_last = int((~ev_sets & last_group).sum())
+        if group[-1] == 0:
+            n_last += state['n_inheritors']
+        state['position'] = group_value[-1]
+        state['position_by_person'] = bool(group_by_person[-1])
+        state['n_inheritors'] = n_last
+
+    # --- Step 4: Per-person fields (column-wise over the person rows) ---
+    person_rows = np.flatnonzero(is_person)
+    if not len(person_rows):
+        return None
+
+    def take(values):
+        return np.asarray(values)[person_rows]
+
+    if has_v2_columns:
+        col_name = take(names)
+        col_salary = take(salaries)
+        col_rank = take(ranks)
+        col_grade = take(grades)
+    else:
+        col_name, col_salary, col_rank = (
+            list(c) for c in zip(*map(parse_metadata_fallback, take(names))))
+        col_grade = [""] * len(person_rows)
+
+    # Surnames repeat heavily, so validate each distinct name once
+    names_s = pd.Series(col_name, dtype=object)
+    name_ok = validate_names(names_s.unique(), name_pool)
+    col_is_name = names_s.map(name_ok).to_numpy(dtype=bool)
+
+    # Detect drafted (military conscription) keywords in raw text
+    col_drafted = (pd.Series(take(raw_texts), dtype=object)
+                   .str.contains(_DRAFT_RE).to_numpy(dtype=bool))
+
+    col_gender_legacy, col_gender_modern = classify_gender_columns(
+        col_name, col_is_name)
+
+    return pd.DataFrame({
+        'year': take(years),
+        'office': current_offices[person_rows],
+        'position': effective_pos[person_rows],
+        'grade': col_grade,
+        'name': col_name,
+        'is_name': col_is_name,
+        'drafted': col_drafted,
+        'gender_legacy': col_gender_legacy,
+        'gender_modern': col_gender_modern,
+        'salary': col_salary,
+        'rank': col_rank,
+        'page': take(folders),
+        'image': take(images),
+        'x': take(xs),
+        'y': take(ys),
+    })
+
+
+def read_stage1(path, chunksize=None):
+    """
+    Yields the stage 1 CSV as DataFrames: the whole file at once, or blocks
+    of chunksize rows. Only the columns the compiler reads are loaded, and
+    text columns stay text (no numeric guessing). The pyarrow engine cannot
+    stream, so chunked reads use the C parser.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in INPUT_COLUMNS]
+    dtype = {c: TEXT_DTYPE for c in usecols if c in TEXT_COLUMNS}
+    if chunksize:
+        yield from pd.read_csv(path, usecols=usecols, dtype=dtype,
+                               chunksize=chunksize)
+    else:
+        yield pd.read_csv(path, usecols=usecols, dtype=dtype,
+                          engine=CSV_ENGINE)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_csv", required=True)
@@ -538,22 +916,20 @@ def main():
                         help="First page of personnel data (skip preamble before this)")
     parser.add_argument("--end_page", type=int, default=None,
                         help="Last page of personnel data (skip appendix after this)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Stream the input in blocks of this many rows "
+                             "to bound memory (default: read it whole)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for Sudachi name validation "
+                             "(default: 1, validate in-process)")
     args = parser.parse_args()
 
-    try:
-        df = pd.read_csv(args.input_csv)
-    except Exception as e:
-        print(f"Error loading CSV file: {e}")
-        return
-
-    has_v2_columns = all(c in df.columns for c in ['grade', 'salary', 'rank'])
-
     # --- Load ALL known positions from crosswalk (all columns) ---
     known_positions = set()
     headers_set = set()
     if os.path.exists(args.crosswalk):
         try:
-            cw = pd.read_csv(args.crosswalk)
+            cw = pd.read_csv(args.crosswalk, engine=CSV_ENGINE)
             title_cols = ['Japanese', 'DuringWar', 'TokyoFu', 'Merged',
                           'BeforeWar', 'AfterWar']
             for col in title_cols:
@@ -567,133 +943,58 @@ def main():
         except:
             pass
 
+    # Freeze and intern the lookup sets; row strings are interned too (in
+    # compile_block), so repeated headers/titles hit the identity fast path
+    def intern_all(values):
+        return frozenset(sys.intern(v) if isinstance(v, str) else v
+                         for v in values)
+
+    known_positions = intern_all(known_positions)
+    headers_set = intern_all(headers_set)
+
     print(f"Loaded {len(known_positions)} position titles, "
           f"{len(headers_set)} office headers from crosswalk.")
 
-    # --- Single-person positions: only the first name gets the title ---
-    single_person_positions = {'課長', '主事', '技師'}
-
     # --- Page range filtering ---
     use_page_range = args.start_page is not None or args.end_page is not None
+    page_range = None
     if use_page_range:
         start_pg = args.start_page if args.start_page is not None else 0
         end_pg = args.end_page if args.end_page is not None else 999999
+        page_range = (start_pg, end_pg)
         print(f"Page range filter: pages {start_pg} to {end_pg}")
 
-    # --- Main compilation loop ---
-    compiled_rows = []
-    current_office = "Unknown Office"
-    current_position = "Unknown"  # Stateful position tracking
-    position_person_count = 0  # Track how many people assigned current position
-
-    n_noise_filtered = 0
-    n_page_filtered = 0
-    n_position_headers = 0
-    n_position_propagated = 0
-
-    for idx, row in df.iterrows():
-        raw_name = str(row.get('name', '')).strip()
-        raw_pos = str(row.get('position', '')).strip()
-
-        if raw_name == "nan": raw_name = ""
-        if raw_pos == "nan": raw_pos = ""
-
-        # --- Step 0a: Page range filter (human-specified) ---
-        if use_page_range:
-            page_num = int(row.get('folder', 0))
-            if page_num < start_pg or page_num > end_pg:
-                n_page_filtered += 1
-                continue
-
-        # --- Step 0b: Filter OCR noise ---
-        if is_likely_noise(row):
-            n_noise_filtered += 1
-            continue
-
-        # --- Step 1: Office header detection (pattern-based) ---
-        raw_text = str(row.get('raw_text', '')).strip()
-        if raw_text == "nan": raw_text = ""
-
-        if is_header_candidate(raw_name, headers_set):
-            current_office = raw_name
-            continue
-        if raw_pos and is_header_candidate(raw_pos, headers_set):
-            current_office = raw_pos
-            continue
-        # Also check raw_text for office names that stage 1 didn't classify
-        if raw_text and not raw_name and not raw_pos:
-            if is_header_candidate(raw_text, headers_set):
-                current_office = raw_text
-                continue
-
-        # --- Step 2: Standalone position header detection ---
-        is_pos_header, detected_pos = is_position_only_row(
-            row, known_positions)
-        if is_pos_header:
-            current_position = detected_pos
-            position_person_count = 0  # Reset counter for new position
-            n_position_headers += 1
-            continue
-
-        # --- Step 3: Process person row ---
-        if raw_name or raw_pos:
-            # Use explicit match if available, otherwise propagate
-            if raw_pos and raw_pos != 'Unknown':
-                effective_pos = raw_pos
-                current_position = raw_pos
-                position_person_count = 1  # This person is the first
-            elif current_position != "Unknown":
-                # Check single-person rule before propagating
-                if current_position in single_person_positions and position_person_count >= 1:
-                    # Already assigned this single-person position to someone
-                    effective_pos = "Unknown"
-                else:
-                    effective_pos = current_position
-                    position_person_count += 1
-                    n_position_propagated += 1
-            else:
-                effective_pos = "Unknown"
-
-            if has_v2_columns:
-                clean_name = raw_name
-                salary = str(row.get('salary', '')).strip()
-                rank = str(row.get('rank', '')).strip()
-                grade = str(row.get('grade', '')).strip()
-                if salary == "nan": salary = ""
-                if rank == "nan": rank = ""
-                if grade == "nan": grade = ""
-            else:
-                clean_name, salary, rank = parse_metadata_fallback(raw_name)
-                grade = ""
-
-            name_flag = is_plausible_name(clean_name)
-
-            # Detect drafted (military conscription) keywords in raw text
-            draft_keywords = ["應召", "召中", "應徴", "徴中", "入營", "營中"]
-            is_drafted = any(k in raw_text for k in draft_keywords)
-
-            entry = {
-                'year': row.get('year', args.year_col),
-                'office': current_office,
-                'position': effective_pos,
-                'grade': grade,
-                'name': clean_name,
-                'is_name': name_flag,
-                'drafted': is_drafted,
-                'gender_legacy': classify_gender_legacy(clean_name) if name_flag else "",
-                'gender_modern': classify_gender_modern(clean_name) if name_flag else "",
-                'salary': salary,
-                'rank': rank,
-                'page': row.get('folder', ''),
-                'image': row.get('image', ''),
-                'x': row.get('x', 0),
-                'y': row.get('y', 0),
-            }
-            compiled_rows.append(entry)
+    # --- Main compilation, block by block ---
+    state = new_compile_state()
+    parts = []
+    # Only Sudachi is slow enough to be worth the process start-up and IPC
+    name_pool = None
+    if args.workers > 1 and _sudachi_tokenizer is not None:
+        name_pool = ProcessPoolExecutor(max_workers=args.workers)
+        print(f"Validating names with {args.workers} worker processes.")
+    blocks = read_stage1(args.input_csv, args.chunksize)
+    try:
+        while True:
+            # Only reading the input is guarded; errors while compiling a
+            # block are bugs and should propagate
+            try:
+                block = next(blocks)
+            except StopIteration:
+                break
+            except Exception as e:
+                print(f"Error loading CSV file: {e}")
+                return
+            part = compile_block(block, state, known_positions, headers_set,
+                                 page_range, args.year_col, name_pool)
+            if part is not None:
+                parts.append(part)
+    finally:
+        if name_pool is not None:
+            name_pool.shutdown()
 
     # --- Output ---
-    if compiled_rows:
-        result_df = pd.DataFrame(compiled_rows)
+    if parts:
+        result_df = pd.concat(parts, ignore_index=True)
 
         # --- Infer office hierarchy ---
         result_df = infer_office_hierarchy(result_df)
@@ -707,7 +1008,13 @@ def main():
         final_cols = [c for c in cols if c in result_df.columns]
         result_df = result_df[final_cols]
 
-        result_df.to_csv(args.output, index=False, encoding='utf-8-sig')
+        # Low-cardinality text columns as categoricals: one small int code
+        # per row instead of a string object, and cheaper comparisons below
+        for col in ('year', 'office', 'position',
+                    'gender_legacy', 'gender_modern'):
+            result_df[col] = result_df[col].astype('category')
+
+        write_csv(result_df, args.output)
 
         n_total = len(result_df)
         n_with_office = (result_df['office'] != 'Unknown Office').sum()
@@ -718,11 +1025,11 @@ def main():
               f"({100*n_with_office/n_total:.1f}%)")
         print(f"  Position assigned:  {n_with_pos} / {n_total} "
               f"({100*n_with_pos/n_total:.1f}%)")
-        print(f"  Position headers found:  {n_position_headers}")
-        print(f"  Positions propagated:    {n_position_propagated}")
+        print(f"  Position headers found:  {state['n_position_headers']}")
+        print(f"  Positions propagated:    {state['n_position_propagated']}")
         if use_page_range:
-            print(f"  Page-range filtered:     {n_page_filtered}")
-        print(f"  Noise rows filtered:     {n_noise_filtered}")
+            print(f"  Page-range filtered:     {state['n_page_filtered']}")
+        print(f"  Noise rows filtered:     {state['n_noise_filtered']}")
 
         n_is_name = result_df['is_name'].sum()
         n_female_legacy = (result_df['gender_legacy'] == 'female').sum()
@@ -0,0 +1,35 @@
+"""
+CSV writer shared by process_tokyo_directory.py and compile_tokyo_dataframe.py.
+"""
+import codecs
+
+# --- Optional pyarrow for fast CSV output ---
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+
+def write_csv(df, path):
+    """
+    Writes df as UTF-8 CSV with a BOM, like to_csv(encoding='utf-8-sig').
+    Uses pyarrow's C writer when installed, falling back to to_csv. The
+    Arrow output reads back into the same frame with pd.read_csv, but it is
+    not byte-identical: the header and every string value are quoted, empty
+    strings are written as "", and whole floats drop the '.0' (3.0 -> 3).
+    """
+    if pa is not None:
+        # Keep pandas' True/False spelling instead of Arrow's true/false
+        bool_cols = [c for c in df.columns if df[c].dtype == bool]
+        try:
+            table = pa.Table.from_pandas(
+                df.astype({c: str for c in bool_cols}), preserve_index=False)
+            with open(path, 'wb') as f:
+                f.write(codecs.BOM_UTF8)
+                pa_csv.write_csv(table, f)
+            return
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # Column types Arrow cannot infer or write — use pandas
+            pass
+    df.to_csv(path, index=False, encoding='utf-8-sig')
@@ -5,14 +5,87 @@ Usage:
     python generate_data_report.py --old_csv <old> --new_csv <new> --output report.md
 """
 import pandas as pd
+import numpy as np
 import argparse
-import sys
+import glob
+import hashlib
+import os
+
+# --- Optional pyarrow: Parquet cache of the parsed CSVs ---
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Parsed CSVs are cached as Parquet here, next to each CSV
+CACHE_DIR = '.cache'
+
+# Columns the report reads from each file; everything else is skipped
+OLD_COLUMNS = frozenset({'year'})
+NEW_COLUMNS = frozenset({
+    'year', 'gov_level', 'office', 'office_id', 'position', 'name',
+    'is_name', 'gender_legacy', 'gender_modern', 'staff_id'})
 
 
 def section(title):
     return f"\n## {title}\n"
 
 
+def read_report_csv(path, columns, use_cache=True):
+    """
+    Reads only the given columns of a master CSV (those it has). If it has
+    none of them, the first column is kept so the row count still holds.
+
+    With pyarrow installed, the parsed columns are cached as Parquet in
+    CACHE_DIR beside the CSV, keyed on the CSV's mtime and size, so repeat
+    runs on an unchanged file skip the CSV parse. The CSV itself is always
+    parsed with the C engine: pandas 1.5's pyarrow engine reads empty cells
+    as '' instead of NaN, which would change the gender and office counts.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in columns] or list(header[:1])
+    if pa is None or not use_cache:
+        return pd.read_csv(path, usecols=usecols)
+
+    stat = os.stat(path)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    col_key = hashlib.md5(','.join(usecols).encode('utf-8')).hexdigest()[:8]
+    prefix = os.path.join(cache_dir, f"{os.path.basename(path)}.{col_key}")
+    cache_path = f"{prefix}.{stat.st_mtime_ns}.{stat.st_size}.parquet"
+    if os.path.exists(cache_path):
+        # Arrow hands back missing strings as None; restore the CSV's NaN
+        return pd.read_parquet(cache_path).fillna(np.nan)
+
+    df = pd.read_csv(path, usecols=usecols)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Drop caches of earlier versions of this file
+        for stale in glob.glob(glob.escape(prefix) + '.*.parquet'):
+            os.remove(stale)
+        df.to_parquet(cache_path, index=False, compression='zstd')
+    except (OSError, pa.ArrowException) as e:
+        # Read-only directory or a column Arrow cannot store — just skip
+        print(f"Note: not caching {path}: {e}")
+    return df
+
+
+def true_false_masks(col):
+    """
+    Returns (is_true, is_false) boolean arrays for a column holding booleans
+    or their spellings ('True', 'false', ...); anything else is neither.
+    Only the distinct values are converted to text.
+    """
+    if col.dtype == bool:
+        is_true = col.to_numpy()
+        return is_true, ~is_true
+    codes, uniques = pd.factorize(col)
+    lowered = pd.Index(uniques).astype(str).str.lower()
+    # Missing values get code -1, which picks the appended False
+    is_true = np.append(lowered == 'true', False)[codes]
+    is_false = np.append(lowered == 'false', False)[codes]
+    return is_true, is_false
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Compare old vs new Tokyo Personnel Master CSV")
@@ -20,12 +93,15 @@ def main():
     parser.add_argument("--new_csv", required=True, help="Path to new master CSV (v2)")
     parser.add_argument("--output", default="data_report.md",
                         help="Output markdown report path")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Always parse the CSVs; don't read or write "
+                             "the Parquet cache")
     args = parser.parse_args()
 
     print(f"Loading old CSV: {args.old_csv}")
-    old = pd.read_csv(args.old_csv)
+    old = read_report_csv(args.old_csv, OLD_COLUMNS, not args.no_cache)
     print(f"Loading new CSV: {args.new_csv}")
-    new = pd.read_csv(args.new_csv)
+    new = read_report_csv(args.new_csv, NEW_COLUMNS, not args.no_cache)
 
     lines = []
     lines.append("# Tokyo Personnel Data Report\n")
@@ -39,17 +115,18 @@ def main():
     lines.append(f"| Total rows | {len(old):,} | {len(new):,} |")
 
     if 'year' in old.columns and 'year' in new.columns:
-        old_years = sorted(old['year'].dropna().unique())
-        new_years = sorted(new['year'].dropna().unique())
-        lines.append(f"| Unique years | {len(old_years)} | {len(new_years)} |")
+        # Rows per year in one grouping pass each (NaN years are dropped)
+        old_by_year = old.groupby('year').size()
+        new_by_year = new.groupby('year').size()
+        lines.append(f"| Unique years | {len(old_by_year)} | {len(new_by_year)} |")
         lines.append("")
         lines.append("**Per-year row counts:**\n")
         lines.append("| Year | Old | New | Diff |")
         lines.append("|------|-----|-----|------|")
-        all_years = sorted(set(list(old_years) + list(new_years)))
+        all_years = sorted(set(old_by_year.index) | set(new_by_year.index))
         for yr in all_years:
-            o = len(old[old['year'] == yr]) if yr in old_years else 0
-            n = len(new[new['year'] == yr]) if yr in new_years else 0
+            o = old_by_year.get(yr, 0)
+            n = new_by_year.get(yr, 0)
             diff = n - o
             sign = "+" if diff > 0 else ""
             lines.append(f"| {yr} | {o:,} | {n:,} | {sign}{diff:,} |")
@@ -57,6 +134,7 @@ def main():
     # --- 2. Non-name filtering ---
     lines.append(section("2. Non-Name Filtering"))
     if 'is_name' in new.columns:
+        is_name_true, is_name_false = true_false_masks(new['is_name'])
         is_name_counts = new['is_name'].value_counts()
         n_true = is_name_counts.get(True, is_name_counts.get('True', 0))
         n_false = is_name_counts.get(False, is_name_counts.get('False', 0))
@@ -68,7 +146,7 @@ def main():
         lines.append("")
 
         # Sample non-name rows
-        non_name = new[new['is_name'].astype(str).str.lower() == 'false']
+        non_name = new[is_name_false]
         if len(non_name) > 0:
             lines.append("**Sample non-name rows (first 10):**\n")
             sample = non_name.head(10)
@@ -110,10 +188,11 @@ def main():
         lines.append("\n**Female counts by year (modern method):**\n")
         lines.append("| Year | Female | Male | % Female |")
         lines.append("|------|--------|------|----------|")
-        for yr in sorted(new['year'].dropna().unique()):
-            yr_df = new[new['year'] == yr]
-            f = (yr_df['gender_modern'] == 'female').sum()
-            m = (yr_df['gender_modern'] == 'male').sum()
+        by_year = pd.DataFrame({
+            'female': new['gender_modern'] == 'female',
+            'male': new['gender_modern'] == 'male',
+        }).groupby(new['year']).sum()
+        for yr, f, m in by_year.itertuples(name=None):
             pct = 100 * f / (f + m) if (f + m) > 0 else 0
             lines.append(f"| {yr} | {f:,} | {m:,} | {pct:.1f}% |")
 
@@ -158,14 +237,13 @@ def main():
             lines.append("\n**Unique offices per year:**\n")
             lines.append("| Year | Unique Offices |")
             lines.append("|------|----------------|")
-            for yr in sorted(new['year'].dropna().unique()):
-                n = new[new['year'] == yr]['office'].nunique()
+            for yr, n in new.groupby('year')['office'].nunique().items():
                 lines.append(f"| {yr} | {n} |")
 
     # --- 6. Sample data ---
     lines.append(section("6. Sample Data (First 10 Clean Rows)"))
     if 'is_name' in new.columns:
-        clean = new[new['is_name'].astype(str).str.lower() == 'true'].head(10)
+        clean = new[is_name_true].head(10)
     else:
         clean = new.head(10)
 
@@ -8,12 +8,18 @@ GetNames Local - UIUC Cluster Version
 
 import os
 import json
-import csv
 import re
+import functools
 import argparse
 import pandas as pd
 from sudachipy import dictionary, tokenizer
 
+# --- Optional orjson: faster JSON decode ---
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Initialize Sudachi Tokenizer Globaly
 try:
     tokenizer_obj = dictionary.Dictionary().create()
@@ -21,6 +27,38 @@ except Exception as e:
     print(f"Warning: SudachiPy initialization failed: {e}")
     tokenizer_obj = None
 
+DIGITS_RE = re.compile(r'\d+')
+# Deletion table for half- and full-width spaces (one C pass per string)
+SPACES_TT = str.maketrans('', '', ' 　')
+# Canonical JSON text of an entry, used as its deduplication key. Always
+# the stdlib encoder: orjson would write NaN as null, merging it with None
+DEDUP_KEY = json.JSONEncoder(sort_keys=True, ensure_ascii=False).encode
+
+def load_json(path):
+    """
+    Parses a UTF-8 JSON file, with orjson when it is installed. orjson is
+    strict JSON, so files it rejects (e.g. bare NaN or Infinity values,
+    which the OCR output can contain) are re-parsed with the stdlib.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data.decode('utf-8'))
+
+# Office-label markers: leading circle symbols and final office characters.
+# Tuples so they can be passed straight to str.startswith / str.endswith.
+CIRCLE_SYMBOLS = ("◎", "〇", "O", "○", "o", "0", "〓")
+OFFICE_ENDINGS = ("課", "係", "所", "房", "合", "院", "室", "場", "局", "屋", "寮", "館", "康", "ム", "班", "部", "衛", "宿", "校")
+OFFICE_ENDING_SET = frozenset(OFFICE_ENDINGS)
+# Military conscription keywords (matches original keyword list)
+DRAFT_KEYWORDS = ("應召", "召中", "應徴", "徴中", "入營", "營中")
+# One C-level scan for any of the keywords instead of a substring test each
+DRAFT_RE = re.compile('|'.join(map(re.escape, DRAFT_KEYWORDS)))
+
 # ===========================
 # SORTING HELPER (The Fix)
 # ===========================
@@ -38,7 +76,7 @@ def get_image_rank(image_name):
     if 'left' in name and 'bottom' in name: return 10
     
     # 2. Handle Numeric Names (NDL)
-    match = re.search(r'\d+', name)
+    match = DIGITS_RE.search(name)
     if match:
         num = int(match.group())
         # If strict 1-4 mapping is needed:
@@ -53,105 +91,135 @@ def get_image_rank(image_name):
 # LABELING LOGIC (Matches Original)
 # ===========================
 def label_office_names(data, circle):
-    circle_symbols = ["◎", "〇", "O", "○", "o", "0", "〓"]
-    ending_characters = ["課", "係", "所", "房", "合", "院", "室", "場", "局", "屋", "寮", "館", "康", "ム", "班", "部", "衛", "宿", "校"]
+    def circled_office(t):
+        # Starts with a circle symbol and contains an office character
+        return t.startswith(CIRCLE_SYMBOLS) and not OFFICE_ENDING_SET.isdisjoint(t)
 
     for entry in data:
         text_sequence = entry.get('text', '')
         if circle == "ON":
             is_office = False
             # Check strictly starting with circle
-            if any(text_sequence.startswith(c) and any(e in text_sequence for e in ending_characters) for c in circle_symbols):
+            if circled_office(text_sequence):
                 is_office = True
             else:
                 for item in entry.get('items', []):
-                    t = item.get('text', '')
-                    if any(t.startswith(c) and any(e in t for e in ending_characters) for c in circle_symbols):
+                    if circled_office(item.get('text', '')):
                         item['label'] = 'Office'
             if is_office: entry['label'] = 'Office'
             
         elif circle == "OFF":
-            if any(text_sequence.endswith(e) for e in ending_characters):
+            if text_sequence.endswith(OFFICE_ENDINGS):
                 entry['label'] = 'Office'
             else:
                 for item in entry.get('items', []):
-                    t = item.get('text', '')
-                    if any(t.endswith(e) for e in ending_characters):
+                    if item.get('text', '').endswith(OFFICE_ENDINGS):
                         item['label'] = 'Office'
     return data
 
+@functools.lru_cache(maxsize=8)
+def _read_position_titles(crosswalk_path, column, mtime):
+    # mtime is part of the cache key so an edited crosswalk is re-read
+    df = pd.read_csv(crosswalk_path)
+    return tuple(df[column].dropna().unique().tolist())
+
+def load_position_titles(crosswalk_path, column):
+    """
+    Returns the unique titles in one crosswalk column. The parsed result is
+    cached per (path, column) and reused until the file is modified, so
+    repeated labeling passes in one run read the CSV only once.
+    """
+    mtime = os.path.getmtime(crosswalk_path)
+    return list(_read_position_titles(crosswalk_path, column, mtime))
+
+def bucket_titles_by_first_char(position_titles):
+    """
+    Groups titles by their first character so a prefix check only has to
+    consider the titles that could possibly match a given text. Buckets
+    are tuples so they can be handed straight to str.startswith.
+    """
+    buckets = {}
+    for title in position_titles:
+        buckets.setdefault(title[:1], []).append(title)
+    return {ch: tuple(titles) for ch, titles in buckets.items()}
+
 def label_position_titles_by_sequence(data, column, crosswalk_path):
     if not os.path.exists(crosswalk_path):
         print(f"Warning: Position Crosswalk not found at {crosswalk_path}")
         return data
 
-    df = pd.read_csv(crosswalk_path)
-    position_titles = df[column].dropna().unique().tolist()
+    position_titles = load_position_titles(crosswalk_path, column)
+    title_set = frozenset(position_titles)
+    title_buckets = bucket_titles_by_first_char(position_titles)
 
     for entry in data:
         if 'label' in entry and entry['label'] == 'Office': continue
-        text_sequence = entry.get('text', '').replace(" ", "").replace("　", "")
+        text_sequence = entry.get('text', '').translate(SPACES_TT)
 
-        if text_sequence in position_titles:
+        if text_sequence in title_set:
             entry['label'] = 'Position'
-        else:
-            for title in position_titles:
-                if text_sequence.startswith(title) and len(text_sequence) > len(title):
-                    entry['label'] = 'Position_and_Name'
-                    break
+        # Not an exact title, so any title it starts with is strictly shorter
+        elif text_sequence.startswith(title_buckets.get(text_sequence[:1], ())):
+            entry['label'] = 'Position_and_Name'
     return data
 
+@functools.lru_cache(maxsize=100_000)
+def tokenize_cached(text):
+    """
+    Tokenizes text in SplitMode.C (Sudachi's default) and returns a tuple of
+    (surface, part_of_speech) pairs. Cached, so a line that is labeled here
+    and later has its names extracted is only run through Sudachi once.
+    """
+    mode = tokenizer.Tokenizer.SplitMode.C
+    return tuple((m.surface(), m.part_of_speech())
+                 for m in tokenizer_obj.tokenize(text, mode))
+
 def label_names_with_sudachipy(data):
     if tokenizer_obj is None: return data
-    mode = tokenizer.Tokenizer.SplitMode.C
-    
+
     for entry in data:
         if 'label' not in entry:
-            text_sequence = entry.get('text', '').replace(" ", "").replace("　", "")
-            tokens = list(tokenizer_obj.tokenize(text_sequence, mode))
-            
+            text_sequence = entry.get('text', '').translate(SPACES_TT)
+            tokens = tokenize_cached(text_sequence)
+
             # Check for Surname + Name pattern
-            for i, token in enumerate(tokens[:-1]):
-                if '姓' in token.part_of_speech() and '名' in tokens[i + 1].part_of_speech():
+            for (_, pos), (_, next_pos) in zip(tokens, tokens[1:]):
+                if '姓' in pos and '名' in next_pos:
                     entry['label'] = 'NameSudachi'
                     break
             else:
                 # Check for Address (Proper Noun + Kanji Numbers)
-                for token in tokens:
-                    if "固有名詞" in token.part_of_speech() and any(k in token.surface() for k in '一二三四五六七八九十百千万'):
+                for surface, pos in tokens:
+                    if "固有名詞" in pos and any(k in surface for k in '一二三四五六七八九十百千万'):
                         entry['label'] = 'AddressSudachi'
                         break
     return data
 
 def label_drafted_entries(data):
-    # Matches original keyword list
-    keywords = ["應召", "召中", "應徴", "徴中", "入營", "營中"]
     for entry in data:
         text_sequence = entry.get('text', '')
-        if any(k in text_sequence for k in keywords):
+        if DRAFT_RE.search(text_sequence):
             entry['label'] = 'drafted'
         else:
             for item in entry.get('items', []):
                 t = item.get('text', '')
-                if any(k in t for k in keywords):
+                if DRAFT_RE.search(t):
                     item['label'] = 'drafted'
     return data
 
 def extract_names(text):
     if tokenizer_obj is None: return []
-    tokens = tokenizer_obj.tokenize(text)
     names, temp_name = [], []
-    for token in tokens:
-        pos = token.part_of_speech()
+    for surface, pos in tokenize_cached(text):
         if pos[0] == '名詞' and pos[1] == '固有名詞':
             if pos[2] == '人名':
-                if pos[3] == '姓': temp_name.append(token.surface())
+                if pos[3] == '姓': temp_name.append(surface)
                 elif pos[3] == '名' and temp_name:
-                    temp_name.append(token.surface())
+                    temp_name.append(surface)
                     names.append(''.join(temp_name))
                     temp_name = []
                 elif pos[3] != '名' and temp_name:
-                    temp_name.append(token.surface())
+                    temp_name.append(surface)
                     names.append(''.join(temp_name))
                     temp_name = []
     return names
@@ -159,29 +227,35 @@ def extract_names(text):
 # ===========================
 # AZURE INTEGRATION
 # ===========================
-def extract_position_titles_simple(text, position_titles):
-    text_sequence = text.replace(" ", "").replace("　", "")
+def extract_position_titles_simple(text, position_titles, title_buckets):
+    text_sequence = text.translate(SPACES_TT)
     if text_sequence in position_titles:
         return 'Position'
-    for title in position_titles:
-        if text_sequence.startswith(title) and len(text_sequence) > len(title):
-            return 'Position_and_Name'
+    # Not an exact title, so any title it starts with is strictly shorter
+    if text_sequence.startswith(title_buckets.get(text_sequence[:1], ())):
+        return 'Position_and_Name'
     return None
 
 def integrate_azure_output(labeled_data, azure_data, position_titles):
     azure_list = []
-    # Loop matches original logic: scan azure data for matching Page+Image
+    title_set = frozenset(position_titles)
+    title_buckets = bucket_titles_by_first_char(position_titles)
+
+    # Index the Azure items that carry a position title by Page+Image, so
+    # each labeled entry is a dict probe instead of a scan of azure_data
+    azure_index = {}
+    for azure_item in azure_data:
+        if extract_position_titles_simple(azure_item.get('text', ''), title_set, title_buckets):
+            key = (azure_item.get('page_name'), azure_item.get('image_name'))
+            azure_index.setdefault(key, []).append(azure_item)
+
+    # Output matches original logic: matching items per labeled entry
     for entry in labeled_data:
-        page_name = entry.get('page_name')
-        image_name = entry.get('image_name')
-        
-        for azure_item in azure_data:
-            if azure_item.get('page_name') == page_name and azure_item.get('image_name') == image_name:
-                position_label = extract_position_titles_simple(azure_item.get('text', ''), position_titles)
-                if position_label:
-                    modified_item = azure_item.copy()
-                    modified_item['label'] = 'Position'
-                    azure_list.append(modified_item)
+        key = (entry.get('page_name'), entry.get('image_name'))
+        for azure_item in azure_index.get(key, ()):
+            modified_item = azure_item.copy()
+            modified_item['label'] = 'Position'
+            azure_list.append(modified_item)
     return azure_list
 
 # ===========================
@@ -193,8 +267,7 @@ def process_directory(year, folder_name, posi_col, circle, base_dir, ocr_mode=''
     
     # Load Position Titles
     try:
-        df_pos = pd.read_csv(crosswalk_path)
-        position_titles = df_pos[posi_col].dropna().unique().tolist()
+        position_titles = load_position_titles(crosswalk_path, posi_col)
     except Exception as e:
         print(f"Error loading crosswalk: {e}")
         return
@@ -208,8 +281,7 @@ def process_directory(year, folder_name, posi_col, circle, base_dir, ocr_mode=''
         # 1. LOAD MAIN NDL DATA
         if ocr_mode != 'Azure' and os.path.isfile(main_json_path):
             print(f"Processing Main: {main_json_path}")
-            with open(main_json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_json(main_json_path)
             data = label_office_names(data, circle)
             data = label_position_titles_by_sequence(data, posi_col, crosswalk_path)
             data = label_names_with_sudachipy(data)
@@ -219,8 +291,7 @@ def process_directory(year, folder_name, posi_col, circle, base_dir, ocr_mode=''
         # 2. LOAD & MERGE AZURE DATA
         if os.path.isfile(azure_json_path):
             print(f"Merging Azure Data from: {azure_json_path}")
-            with open(azure_json_path, 'r', encoding='utf-8') as f:
-                azure_data = json.load(f)
+            azure_data = load_json(azure_json_path)
             
             if ocr_mode == 'Azure':
                 # Azure Only Mode
@@ -237,8 +308,11 @@ def process_directory(year, folder_name, posi_col, circle, base_dir, ocr_mode=''
                 labeled_data.extend(azure_items)
 
         # 3. DEDUPLICATE
-        unique_data = {json.dumps(item, sort_keys=True) for item in labeled_data}
-        labeled_data = [json.loads(item) for item in unique_data]
+        # Keyed on the canonical JSON text. Survivors are rebuilt from that
+        # text, so every dict (nested ones too) has sorted keys: the CSV
+        # header and the nested cells depend on that order
+        unique_keys = dict.fromkeys(map(DEDUP_KEY, labeled_data))
+        labeled_data = [json.loads(key) for key in unique_keys]
 
         # 4. ROBUST SPATIAL SORT (Page -> Score(Desc) -> Y)
         labeled_data.sort(key=lambda x: (
@@ -253,16 +327,19 @@ def process_directory(year, folder_name, posi_col, circle, base_dir, ocr_mode=''
         else:
             output_csv = main_json_path.replace('.json', '_Modified.csv')
 
-        final_rows = []
-        for entry in labeled_data:
-            row = entry.copy()
-            if row.get('label') in ['NameSudachi', 'Position_and_Name']:
-                extracted = extract_names(row.get('text', ''))
-                for i, name in enumerate(extracted):
-                    row[f'Name{i+1}'] = name
-            final_rows.append(row)
+        # Names per row position, joined on as Name1..NameK columns at once
+        # instead of copying every entry to add them
+        extracted = {
+            i: extract_names(entry.get('text', ''))
+            for i, entry in enumerate(labeled_data)
+            if entry.get('label') in ('NameSudachi', 'Position_and_Name')
+        }
+        df = pd.DataFrame(labeled_data)
+        if extracted:
+            names_df = pd.DataFrame(list(extracted.values()), index=list(extracted))
+            df = df.join(names_df.rename(columns=lambda k: f'Name{k+1}'))
 
-        pd.DataFrame(final_rows).to_csv(output_csv, index=False, encoding='utf-8-sig')
+        df.to_csv(output_csv, index=False, encoding='utf-8-sig')
         print(f"Success: Saved to {output_csv}")
 
     except Exception as e:
@@ -4,8 +4,11 @@ import pandas as pd
 import xml.etree.ElementTree as ET
 import argparse
 import re
+import functools
 from tqdm import tqdm
 
+from csv_output import write_csv
+
 # --- Sudachi Imports for Name Splitting ---
 try:
     from sudachipy import dictionary, tokenizer
@@ -37,12 +40,24 @@ MISC_METADATA_RE = re.compile(
     r'|[一二三四五六七八九十]+等'  # Grade (e.g. 七等)
     r'|技手|嘱託|兼務'           # Common suffixes
     r'|休職|待命|出向)')          # Status markers
+# Whitespace / separators left over after metadata removal
+SEPARATOR_RE = re.compile(r'[\s　,、]+')
+# Both of the above in one alternation, so cleanup scans the text once.
+# Equivalent to applying them in sequence: the two never share a character.
+MISC_OR_SEPARATOR_RE = re.compile(
+    MISC_METADATA_RE.pattern + '|' + SEPARATOR_RE.pattern)
+
+# Page number in an XML path (e.g. .../Page12/...), else any digit run in the filename
+PAGE_DIR_RE = re.compile(r'Page(\d+)')
+DIGITS_RE = re.compile(r'(\d+)')
 
 
+@functools.lru_cache(maxsize=100_000)
 def strip_metadata(text):
     """
     Extracts salary, rank, and grade prefixes from raw text BEFORE
     name splitting. Returns (cleaned_text, salary, rank, grade).
+    Memoized: the same name strings recur across many pages.
     """
     if not isinstance(text, str):
         return "", "", "", ""
@@ -69,11 +84,9 @@ def strip_metadata(text):
         grade = grade_match.group(1)
         text = text[grade_match.end():]
 
-    # 4. Strip misc metadata tokens (勅任, 奏任, etc.)
-    text = MISC_METADATA_RE.sub('', text)
-
-    # Clean up any leftover whitespace / punctuation
-    text = re.sub(r'[\s　,、]+', '', text)  # collapse whitespace
+    # 4. Strip misc metadata tokens (勅任, 奏任, etc.) and any leftover
+    #    whitespace / punctuation in the same pass
+    text = MISC_OR_SEPARATOR_RE.sub('', text)
     return text.strip(), salary, rank, grade
 
 
@@ -192,22 +205,25 @@ def sort_lines_by_columns(lines, tolerance=30):
 
     lines_sorted_x = sorted(lines, key=lambda e: e['x'], reverse=True)
 
+    # Keep a running sum of center x per column so the average is O(1)
     columns = []
+    center_sums = []
     for line in lines_sorted_x:
         center_x = line['x'] + (line['w'] / 2)
         placed = False
 
-        for col in columns:
-            col_x_values = [l['x'] + (l['w'] / 2) for l in col]
-            avg_col_x = sum(col_x_values) / len(col_x_values)
+        for c, col in enumerate(columns):
+            avg_col_x = center_sums[c] / len(col)
 
             if abs(center_x - avg_col_x) < tolerance:
                 col.append(line)
+                center_sums[c] += center_x
                 placed = True
                 break
 
         if not placed:
             columns.append([line])
+            center_sums.append(center_x)
 
     columns.sort(key=lambda col: sum(l['x'] for l in col) / len(col), reverse=True)
 
@@ -222,24 +238,53 @@ def sort_lines_by_columns(lines, tolerance=30):
 # ==========================================
 # 3. POSITION MATCHING (Improved)
 # ==========================================
-def match_position(text, known_titles):
+def build_title_trie(titles):
+    """
+    Builds a character trie over position titles for anchored prefix lookup.
+    Each node maps a character to its child node; the key None marks the
+    end of a complete title and holds that title.
+    """
+    root = {}
+    for title in titles:
+        node = root
+        for ch in title:
+            node = node.setdefault(ch, {})
+        node[None] = title
+    return root
+
+
+def longest_title_prefix(text, title_trie):
+    """
+    Walks the trie from the start of text and returns the longest title
+    that text begins with, or None. One pass over text regardless of how
+    many titles the crosswalk holds.
+    """
+    node = title_trie
+    best_match = None
+    for ch in text:
+        node = node.get(ch)
+        if node is None:
+            break
+        if None in node:
+            best_match = node[None]
+    return best_match
+
+
+def match_position(text, title_trie):
     """
     Match position title from text, handling grade prefixes.
     
     Example: "七上技師" -> grade="七上", position="技師"
              "技師"     -> grade="",    position="技師"
     
+    title_trie is the output of build_title_trie().
     Returns (position, grade, remaining_text)
     """
     if not text:
         return "Unknown", "", text
 
-    # 1. Try direct startswith match first (longest match wins)
-    best_match = None
-    for title in known_titles:
-        if text.startswith(title):
-            if best_match is None or len(title) > len(best_match):
-                best_match = title
+    # 1. Try direct prefix match first (longest match wins)
+    best_match = longest_title_prefix(text, title_trie)
 
     if best_match:
         remaining = text[len(best_match):].strip()
@@ -251,11 +296,7 @@ def match_position(text, known_titles):
         grade_prefix = grade_match.group(1)
         text_after_grade = text[grade_match.end():]
 
-        best_match = None
-        for title in known_titles:
-            if text_after_grade.startswith(title):
-                if best_match is None or len(title) > len(best_match):
-                    best_match = title
+        best_match = longest_title_prefix(text_after_grade, title_trie)
 
         if best_match:
             remaining = text_after_grade[len(best_match):].strip()
@@ -265,6 +306,24 @@ def match_position(text, known_titles):
     return "Unknown", "", text
 
 
+def make_position_matcher(title_trie):
+    """
+    Returns match_position bound to title_trie and memoized on the line
+    text, so repeated lines (the same title on hundreds of rows) skip the
+    trie walk and grade-prefix regex entirely.
+    """
+    if not title_trie:
+        # No crosswalk titles: nothing can ever match, so skip all work
+        def no_match(text):
+            return "Unknown", "", text
+        return no_match
+
+    @functools.lru_cache(maxsize=200_000)
+    def match(text):
+        return match_position(text, title_trie)
+    return match
+
+
 # ==========================================
 # 4. MAIN EXECUTION
 # ==========================================
@@ -292,6 +351,7 @@ def main():
             pass
 
     print(f"Loaded {len(known_titles)} titles from crosswalk.")
+    match_title = make_position_matcher(build_title_trie(known_titles))
 
     # Find XML Files
     xml_files = glob.glob(os.path.join(args.input_dir, "**", "*.xml"), recursive=True)
@@ -300,7 +360,7 @@ def main():
     # Sort XML files by page number to ensure correct reading order
     def xml_sort_key(path):
         fname = os.path.basename(path)
-        m = re.search(r'Page(\d+)', path) or re.search(r'(\d+)', fname)
+        m = PAGE_DIR_RE.search(path) or DIGITS_RE.search(fname)
         return int(m.group(1)) if m else 999999
 
     xml_files.sort(key=xml_sort_key)
@@ -309,7 +369,10 @@ def main():
     if not xml_files:
         return
 
-    all_data = []
+    # Output columns, appended in parallel (one entry per OCR line)
+    col_position, col_grade, col_name = [], [], []
+    col_salary, col_rank, col_raw_text = [], [], []
+    col_x, col_y, col_folder, col_image, col_split_method = [], [], [], [], []
 
     for xml_file in tqdm(xml_files):
         # A. Parse Crops
@@ -334,7 +397,7 @@ def main():
         sorted_pagenames = sorted(pages_dict.keys(), key=page_sort_key)
 
         filename = os.path.basename(xml_file)
-        page_match = re.search(r'Page(\d+)', xml_file) or re.search(r'(\d+)', filename)
+        page_match = PAGE_DIR_RE.search(xml_file) or DIGITS_RE.search(filename)
         page_num = int(page_match.group(1)) if page_match else 999999
 
         # C. Process Sorted Crops
@@ -346,7 +409,7 @@ def main():
                 text = line_obj['text']
 
                 # === KEY CHANGE: Position matching with grade-prefix awareness ===
-                position, grade, raw_name_text = match_position(text, known_titles)
+                position, grade, raw_name_text = match_title(text)
 
                 # === KEY CHANGE: Strip metadata BEFORE name splitting ===
                 cleaned_text, salary, rank, grade_from_name = strip_metadata(raw_name_text)
@@ -359,44 +422,43 @@ def main():
                 extracted_names = extract_names(cleaned_text)
 
                 if extracted_names:
-                    # One row per extracted name
-                    for name_chunk in extracted_names:
-                        all_data.append({
-                            'office': 'Unknown Office',
-                            'position': position,
-                            'grade': grade,
-                            'name': name_chunk,
-                            'salary': salary,
-                            'rank': rank,
-                            'raw_text': text,
-                            'x': line_obj['x'],
-                            'y': line_obj['y'],
-                            'folder': page_num,
-                            'image': img_name,
-                            'year': args.year_col,
-                            'split_method': 'sudachi'
-                        })
+                    split_method = 'sudachi'
                 else:
                     # Fallback: keep cleaned text as name
-                    all_data.append({
-                        'office': 'Unknown Office',
-                        'position': position,
-                        'grade': grade,
-                        'name': cleaned_text if cleaned_text else raw_name_text,
-                        'salary': salary,
-                        'rank': rank,
-                        'raw_text': text,
-                        'x': line_obj['x'],
-                        'y': line_obj['y'],
-                        'folder': page_num,
-                        'image': img_name,
-                        'year': args.year_col,
-                        'split_method': 'none'
-                    })
-
-    if all_data:
-        df = pd.DataFrame(all_data)
-        df.to_csv(args.output, index=False, encoding='utf-8-sig')
+                    extracted_names = [cleaned_text if cleaned_text else raw_name_text]
+                    split_method = 'none'
+
+                # One entry per OCR line; the name list is exploded into
+                # one row per person when the DataFrame is built
+                col_position.append(position)
+                col_grade.append(grade)
+                col_name.append(extracted_names)
+                col_salary.append(salary)
+                col_rank.append(rank)
+                col_raw_text.append(text)
+                col_x.append(line_obj['x'])
+                col_y.append(line_obj['y'])
+                col_folder.append(page_num)
+                col_image.append(img_name)
+                col_split_method.append(split_method)
+
+    if col_name:
+        df = pd.DataFrame({
+            'office': 'Unknown Office',
+            'position': col_position,
+            'grade': col_grade,
+            'name': col_name,
+            'salary': col_salary,
+            'rank': col_rank,
+            'raw_text': col_raw_text,
+            'x': col_x,
+            'y': col_y,
+            'folder': col_folder,
+            'image': col_image,
+            'year': args.year_col,
+            'split_method': col_split_method,
+        }).explode('name', ignore_index=True)
+        write_csv(df, args.output)
         print(f"Success: Extracted {len(df)} rows to {args.output}")
         # Summary stats
         n_sudachi = (df['split_method'] == 'sudachi').sum()
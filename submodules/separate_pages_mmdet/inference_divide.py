@@ -1,4 +1,3 @@
-import mmengine
 #!/usr/bin/env python
 
 # Copyright (c) 2023, National Diet Library, Japan
@@ -12,7 +11,12 @@ import glob
 import cv2
 import numpy as np
 import mmcv
+import mmengine
+import torch
+from mmcv.transforms import Compose
+from mmengine.config import ConfigDict
 from mmdet.apis import (inference_detector, init_detector)
+from mmdet.models.data_preprocessors import DetDataPreprocessor
 
 import time
 
@@ -47,6 +51,85 @@ def draw_legand(img, origin, classes, colors, ssz: int = 16):
     return img
 
 
+# ImageNet normalization stats, in RGB channel order
+IMAGENET_MEAN = [123.675, 116.28, 103.53]
+IMAGENET_STD  = [58.395, 57.12, 57.375]
+
+# Detections (x0, y0, x1, y1, score) for a class with none; read-only so
+# it can be shared between results
+EMPTY_DETS = np.zeros((0, 5), dtype=np.float32)
+EMPTY_DETS.flags.writeable = False
+
+
+# Manual GPU preprocessing for MMDetection 3.x: stack the batch, flip BGR to
+# RGB and normalize. mean/std are registered buffers, so they are created
+# once and follow the module to the GPU instead of being rebuilt per batch.
+class NuclearPreprocessor(DetDataPreprocessor):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register_buffer('_mean', torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1))
+        self.register_buffer('_std', torch.tensor(IMAGENET_STD).view(1, 3, 1, 1))
+        # BGR -> RGB channel index, kept on the device with the stats
+        self.register_buffer('_bgr2rgb', torch.tensor([2, 1, 0], dtype=torch.long))
+        # Side stream for the host-to-device copy, so it can overlap with
+        # work still queued on the compute stream
+        self._copy_stream = torch.cuda.Stream()
+        # Pinned staging buffer reused across batches (pinning is costly),
+        # grown on demand; the event marks when its last copy finished
+        self._pinned = torch.empty(0, dtype=torch.uint8, pin_memory=True)
+        self._copy_done = torch.cuda.Event()
+
+    def forward(self, data, training=False):
+        inputs = data["inputs"]
+        shape = torch.Size((len(inputs),) + tuple(inputs[0].shape))
+        if self._pinned.numel() < shape.numel() or self._pinned.dtype != inputs[0].dtype:
+            self._pinned = torch.empty(shape.numel(), dtype=inputs[0].dtype,
+                                       pin_memory=True)
+        # The previous batch's copy may still be reading the staging buffer
+        self._copy_done.synchronize()
+        staging = self._pinned[:shape.numel()].view(shape)
+        torch.stack(inputs, out=staging)
+
+        # Ship the uint8 batch from pinned memory asynchronously, then cast
+        # on the GPU (a quarter of the PCIe bytes of a float32 copy)
+        with torch.cuda.stream(self._copy_stream):
+            batch = staging.to("cuda", non_blocking=True)
+            self._copy_done.record()
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_stream(self._copy_stream)
+        # The copy stream allocated batch; tell the caching allocator it is
+        # now used on the compute stream too
+        batch.record_stream(compute_stream)
+        data["inputs"] = self.normalize(batch)
+        return data
+
+    def normalize(self, batch):
+        # Flip BGR -> RGB while still uint8, then cast; the cast yields a
+        # fresh tensor, so normalize it in place
+        batch = batch.index_select(1, self._bgr2rgb).float()
+        return batch.sub_(self._mean).div_(self._std)
+
+    def compile_normalize(self):
+        # PyTorch 2.x: let TorchInductor fuse flip, cast and normalize into
+        # one kernel. Page sizes vary, so compile for dynamic shapes.
+        # torch.compile is lazy, so a failure surfaces on the first call; the
+        # wrapper catches it and switches this module back to eager for good
+        # (rather than setting dynamo's process-wide suppress_errors).
+        if not hasattr(torch, "compile"):
+            return
+        eager = self.normalize
+        compiled = torch.compile(eager, dynamic=True)
+
+        def normalize(batch):
+            try:
+                return compiled(batch)
+            except Exception as e:
+                print(f"[Compile Error] {e}; normalizing in eager mode")
+                self.normalize = eager
+                return eager(batch)
+        self.normalize = normalize
+
+
 class GutterDetector:
     def __init__(self, config: str, checkpoint: str, device: str):
         print(f'load from config={config}, checkpoint={checkpoint}')
@@ -57,6 +140,8 @@ class GutterDetector:
 
     def load(self, config: str, checkpoint: str, device: str):
         self.model = init_detector(config, checkpoint, device)
+        # Built from the patched config on the first predict_batch
+        self._test_pipeline = None
         # PATCH: Manual GPU Override for MMDetection 3.x (V12)
         if hasattr(self.model, "cfg"):
             clean_pipeline = [
@@ -65,148 +150,88 @@ class GutterDetector:
                 dict(type="PackDetInputs", meta_keys=("img_id", "img_path", "ori_shape", "img_shape", "scale_factor"))
             ]
             try:
-                import torch
-                from mmengine.config import ConfigDict
-                from mmdet.models.data_preprocessors import DetDataPreprocessor
-                
                 self.model.cfg.data.test.pipeline = clean_pipeline
                 self.model.cfg.test_pipeline = clean_pipeline
                 if not hasattr(self.model.cfg, "test_dataloader"):
                     self.model.cfg.test_dataloader = ConfigDict({"dataset": ConfigDict({"pipeline": clean_pipeline})})
-                
-                class NuclearPreprocessor(DetDataPreprocessor):
-                    def forward(self, data, training=False):
-                        inputs = data["inputs"]
-                        batch = torch.stack(inputs).float().cuda()
-                        mean = torch.tensor([123.675, 116.28, 103.53], device="cuda").view(1, 3, 1, 1)
-                        std = torch.tensor([58.395, 57.12, 57.375], device="cuda").view(1, 3, 1, 1)
-                        batch = batch[:, [2, 1, 0], ...]
-                        batch = (batch - mean) / std
-                        data["inputs"] = batch
-                        return data
-                
-                preprocessor = NuclearPreprocessor()
-                preprocessor.cuda()
-                self.model.data_preprocessor = preprocessor
             except Exception as e:
                 print(f"[Patch Error] {e}")
-                class NuclearPreprocessor(DetDataPreprocessor):
-                    def forward(self, data, training=False):
-                        inputs = data["inputs"]
-                        batch = torch.stack(inputs).float().cuda()
-                        mean = torch.tensor([123.675, 116.28, 103.53], device="cuda").view(1, 3, 1, 1)
-                        std = torch.tensor([58.395, 57.12, 57.375], device="cuda").view(1, 3, 1, 1)
-                        batch = batch[:, [2, 1, 0], ...]
-                        batch = (batch - mean) / std
-                        data["inputs"] = batch
-                        return data
-                
+
+            # Inject the new brain (Initialize first, THEN move to cuda)
+            try:
                 preprocessor = NuclearPreprocessor()
                 preprocessor.cuda()
                 self.model.data_preprocessor = preprocessor
-                
-            except Exception as e:
-                print(f"[Patch Error] {e}")
-                class NuclearPreprocessor(DetDataPreprocessor):
-                    def forward(self, data, training=False):
-                        # 1. Extract inputs (List of Tensors)
-                        inputs = data["inputs"]
-                        # 2. Stack them into a Batch Tensor
-                        batch = torch.stack(inputs)
-                        # 3. Move to GPU and convert to Float
-                        batch = batch.float().cuda()
-                        # 4. Manual Normalization (ImageNet stats)
-                        mean = torch.tensor([123.675, 116.28, 103.53], device="cuda").view(1, 3, 1, 1)
-                        std = torch.tensor([58.395, 57.12, 57.375], device="cuda").view(1, 3, 1, 1)
-                        # 5. BGR -> RGB (Flip channels)
-                        batch = batch[:, [2, 1, 0], ...]
-                        # 6. Normalize
-                        batch = (batch - mean) / std
-                        
-                        data["inputs"] = batch
-                        return data
-                
-                # Inject the new brain (Initialize first, THEN move to cuda)
-                preprocessor = NuclearPreprocessor()
-                preprocessor.cuda()
-                self.model.data_preprocessor = preprocessor
-                
-            except Exception as e:
-                print(f"[Patch Error] {e}")
-                class NuclearPreprocessor(DetDataPreprocessor):
-                    def forward(self, data, training=False):
-                        # 1. Extract inputs (List of Tensors)
-                        inputs = data["inputs"]
-                        # 2. Stack them into a Batch Tensor
-                        batch = torch.stack(inputs)
-                        # 3. Move to GPU and convert to Float
-                        batch = batch.float().cuda()
-                        # 4. Manual Normalization (ImageNet stats)
-                        mean = torch.tensor([123.675, 116.28, 103.53], device="cuda").view(1, 3, 1, 1)
-                        std = torch.tensor([58.395, 57.12, 57.375], device="cuda").view(1, 3, 1, 1)
-                        # 5. BGR -> RGB (Flip channels)
-                        batch = batch[:, [2, 1, 0], ...]
-                        # 6. Normalize
-                        batch = (batch - mean) / std
-                        
-                        data["inputs"] = batch
-                        return data
-                
-                # Inject the new brain
-                self.model.data_preprocessor = NuclearPreprocessor(device="cuda")
-                
-            except Exception as e:
-                print(f"[Patch Error] {e}")
-                class GPUForcedPreprocessor(DetDataPreprocessor):
-                    def forward(self, data, training=False):
-                        # Force inputs to GPU immediately
-                        if "inputs" in data:
-                            data["inputs"] = [t.cuda() for t in data["inputs"]]
-                        return super().forward(data, training)
-                
-                preprocessor = GPUForcedPreprocessor(
-                    mean=[123.675, 116.28, 103.53], 
-                    std=[58.395, 57.12, 57.375], 
-                    bgr_to_rgb=True, 
-                    pad_size_divisor=32
-                )
-                self.model.data_preprocessor = preprocessor
-                self.model.data_preprocessor.to(self.model.device)
-                
             except Exception as e:
                 print(f"[Patch Error] {e}")
+            else:
+                # Installed either way; compiling is only a speed-up
+                try:
+                    preprocessor.compile_normalize()
+                except Exception as e:
+                    print(f"[Compile Error] {e}; normalizing in eager mode")
+
     def predict(self, img):
+        return self._to_bbox_results(inference_detector(self.model, img))
+
+    def predict_batch(self, imgs: list):
+        # inference_detector runs one forward pass per image, so the batch
+        # is assembled here. NuclearPreprocessor stacks without padding and
+        # keep_ratio resizes give each aspect ratio its own shape, so images
+        # are grouped by their resized shape and each group is one pass.
+        if self._test_pipeline is None:
+            self._test_pipeline = Compose(self.model.cfg.test_dataloader.dataset.pipeline)
+        groups = {}
+        for i, img in enumerate(imgs):
+            data = self._test_pipeline(dict(img_path=img, img_id=0))
+            groups.setdefault(tuple(data['inputs'].shape), []).append((i, data))
+
+        results = [None] * len(imgs)
+        for group in groups.values():
+            batch = dict(inputs=[data['inputs'] for _, data in group],
+                         data_samples=[data['data_samples'] for _, data in group])
+            with torch.no_grad():
+                outputs = self.model.test_step(batch)
+            for (i, _), output in zip(group, outputs):
+                results[i] = self._to_bbox_results(output)
+        return results
+
+    def _to_bbox_results(self, result):
         # PATCH: Convert MMDetection 3.x Output to 2.x Format (V14)
-        result = inference_detector(self.model, img)
         try:
             if not isinstance(result, (tuple, list)):
-                import numpy as np
-                pred = result.pred_instances.cpu().numpy()
-                bboxes = pred.bboxes
-                scores = pred.scores
-                labels = pred.labels
+                pred = result.pred_instances
                 
-                if len(bboxes) == 0:
+                if len(pred.bboxes) == 0:
                     # Return empty list of arrays if nothing found
-                    return [np.zeros((0, 5), dtype=np.float32)]
-                    
-                dets = np.hstack((bboxes, scores[:, None]))
+                    return [EMPTY_DETS]
+                
+                # Group by class on the device: a stable sort keeps each
+                # class's detections in score order. The sorted detections
+                # then come back in one contiguous copy (plus the labels).
+                labels, order = torch.sort(pred.labels, stable=True)
+                dets = torch.cat((pred.bboxes[order], pred.scores[order, None]), dim=1)
+                dets = dets.cpu().numpy()
+                labels = labels.cpu().numpy()
                 
                 num_classes = 1
                 if hasattr(self.model, "dataset_meta") and "classes" in self.model.dataset_meta:
                     num_classes = len(self.model.dataset_meta["classes"])
                 elif len(labels) > 0:
-                    num_classes = max(labels) + 1
+                    num_classes = labels[-1] + 1
                 
-                bbox_results = []
-                for i in range(num_classes):
-                    bbox_results.append(dets[labels == i])
+                # Slice the sorted detections at the class boundaries; classes
+                # with no detections share one read-only empty array
+                bounds = np.searchsorted(labels, np.arange(num_classes + 1))
+                bbox_results = [dets[lo:hi] if hi > lo else EMPTY_DETS
+                                for lo, hi in zip(bounds[:-1], bounds[1:])]
                 
                 # V14 FIX: Return the LIST directly, not a tuple
                 return bbox_results
         except Exception as e:
             print(f"[Conversion Error] {e}")
         return result
+
     def show(self, img_path: str, result, score_thr: float = 0.1, border: int = 3,
              show_legand: bool = True):
         img = cv2.imread(img_path)
@@ -318,7 +343,11 @@ def divide_facing_page(input, output: str = "NO_DUMP",
                        conf_th: float = 0.2,
                        config: str = DEFAULT_CONFIG_PATH,
                        checkpoint: str = DEFAULT_MODEL_PATH,
-                       device: str = 'cuda:0', dump_rect: str = None):
+                       device: str = 'cuda:0', dump_rect: str = None,
+                       batch_size: int = 1):
+
+    if batch_size < 1:
+        raise ValueError(f'batch_size must be at least 1, got {batch_size}')
 
     print(f'Loading model: {checkpoint}')
     print(f'       Config: {config}')
@@ -342,12 +371,20 @@ def divide_facing_page(input, output: str = "NO_DUMP",
     if output is not None and output != 'NO_DUMP':
         os.makedirs(output, exist_ok=True)
 
+    def iter_results():
+        # Run the detector batch_size images at a time
+        for start in range(0, len(img_path_list), batch_size):
+            batch_paths = img_path_list[start:start + batch_size]
+            if len(batch_paths) == 1:
+                yield batch_paths[0], detector.predict(batch_paths[0])
+            else:
+                yield from zip(batch_paths, detector.predict_batch(batch_paths))
+
     print('start inference')
     time_sta = time.time()  # for debug
 
-    for img_path in img_path_list:
+    for img_path, result in iter_results():
         print(f'processing ... {img_path}')
-        result = detector.predict(img_path)
 
         if dump_rect is not None:  # for debug
             img = detector.show(img_path, result, score_thr=conf_th, border=5)
@@ -415,8 +452,15 @@ def divide_facing_page_with_cli(
     return output_img_list
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {number}')
+    return number
+
+
 def parse_args():
-    usage = 'python3 {} [-i INPUT] [-o OUTPUT] [-l LEFT] [-r RIGHT] [-s SINGLE] [-e EXT] [-q QUALITY] [-c CONFIG] [-w WEIGHT]'.format(__file__)
+    usage = 'python3 {} [-i INPUT] [-o OUTPUT] [-l LEFT] [-r RIGHT] [-s SINGLE] [-e EXT] [-q QUALITY] [-c CONFIG] [-w WEIGHT] [-b BATCH_SIZE]'.format(__file__)
     argparser = argparse.ArgumentParser(
         usage=usage,
         description='Divide facing images at the gutter',
@@ -494,6 +538,12 @@ def parse_args():
         help=f'Model weight pth file path. Default: {DEFAULT_MODEL_PATH}',
         type=str
     )
+    argparser.add_argument(
+        '-b', '--batch_size',
+        default=1,
+        help='Number of images read per detector call. Default: 1\n'
+             'Images that resize to the same shape share a forward pass.',
+        type=positive_int)
     argparser.add_argument(
         '--debug',
         help='Debug mode flag',
@@ -519,4 +569,4 @@ if __name__ == '__main__':
                        log=args.log,
                        conf_th=0.2,
                        config=args.config, checkpoint=args.weight,
-                       device='cuda:0')
+                       device='cuda:0', batch_size=args.batch_size)